@@ -5,24 +5,65 @@ This agent demonstrates how an AI agent uses tools with Agent Identity tokens.
 
 import os
 import json
+import queue
 import base64
+import contextvars
+import gzip
+import hashlib
+import re
 import requests
 import time
-from flask import Flask, request, jsonify, render_template_string
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 
-# Rate limiting
-last_bedrock_call_time = 0
+# Rate limiting - token bucket: allow a small burst, then one call per BEDROCK_RATE_LIMIT_SECONDS
 BEDROCK_RATE_LIMIT_SECONDS = 20
+BEDROCK_BURST = int(os.environ.get('BEDROCK_BURST', '3'))
+
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() reserves a token and returns how long to wait for it"""
+
+    def __init__(self, capacity, rate_per_sec):
+        self.capacity = float(capacity)
+        self.rate = rate_per_sec
+        self.tokens = float(capacity)
+        self.last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            # Reserve the next token now so concurrent callers queue up behind each other
+            wait = (1 - self.tokens) / self.rate
+            self.tokens -= 1
+            return wait
+
+
+bedrock_bucket = TokenBucket(BEDROCK_BURST, 1 / BEDROCK_RATE_LIMIT_SECONDS)
 
 # LangChain imports - using try/except for graceful fallback
 LANGCHAIN_AVAILABLE = False
 ChatBedrock = None
+ChatBedrockConverse = None
 tool = None
 
 try:
-    from langchain_aws import ChatBedrock
+    from botocore.config import Config as BotoConfig
+    from langchain_aws import ChatBedrock, ChatBedrockConverse
     from langchain_core.tools import tool
+    from langchain_core.messages import SystemMessage
     from langchain_core.prompts import ChatPromptTemplate
     from langgraph.prebuilt import create_react_agent
     LANGCHAIN_AVAILABLE = True
@@ -43,9 +84,93 @@ TENANT_ID = os.environ.get('TENANT_ID', '')
 CLIENT_SPA_APP_ID = os.environ.get('CLIENT_SPA_APP_ID', '')
 AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
 BEDROCK_MODEL_ID = os.environ.get('BEDROCK_MODEL_ID', 'anthropic.claude-3-sonnet-20240229-v1:0')
+# botocore settings for the bedrock-runtime client: keep-alive pool, fast connect, bounded retries.
+# Adaptive mode backs off on Bedrock throttling per API call, so a throttled turn never reruns the graph.
+BEDROCK_CLIENT_CONFIG = {
+    "tcp_keepalive": True,
+    "max_pool_connections": 50,
+    "connect_timeout": 5,
+    "read_timeout": 60,
+    "retries": {"max_attempts": 4, "mode": "adaptive"},
+}
+# Set to 1 to always send Bedrock-mode queries to the LLM (disables the direct fast path)
+AGENT_FORCE_LLM = os.environ.get('AGENT_FORCE_LLM', '0') == '1'
+# Opt-in: Bedrock latency-optimized inference (only some models/regions support it)
+BEDROCK_LATENCY_OPTIMIZED = os.environ.get('BEDROCK_LATENCY_OPTIMIZED', '0') == '1'
+
+class AppResources:
+    """Long-lived clients, pools and caches shared by every request.
+    
+    Built once at import so nothing on the request path constructs its own HTTP
+    session, executor or SDK client. The Bedrock client and the LangChain agent
+    are filled in lazily by check_bedrock_available() / get_weather_agent().
+    """
+    
+    def __init__(self):
+        # HTTP session for sidecar and Weather API calls - keeps connections alive
+        # across requests instead of paying a TCP (+TLS) handshake per call.
+        self.http = requests.Session()
+        # Transient failures (connection errors, 429, 5xx) on idempotent GETs are retried with backoff;
+        # raise_on_status=False hands the last response back so callers still see the status code.
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32,
+                              max_retries=Retry(total=3, backoff_factor=0.3,
+                                                status_forcelist=(429, 500, 502, 503, 504),
+                                                allowed_methods=frozenset(['GET']),
+                                                raise_on_status=False))
+        self.http.mount('http://', adapter)
+        self.http.mount('https://', adapter)
+        self.http.headers.update({'Connection': 'keep-alive'})
+        
+        # Background workers for sidecar calls that can overlap the main request flow
+        self.executor = ThreadPoolExecutor(max_workers=8)
+        
+        # Agent Identity token cache: AGENT_APP_ID -> (authorization_header, exp)
+        self.token_cache = {}
+        # Formatted weather results: city (lowercase) -> (fetched_at, result), guarded by weather_lock
+        self.weather_cache = OrderedDict()
+        self.weather_lock = threading.Lock()
+        # Decoded JWT claims: blake2b digest of the token -> (exp, claims), guarded by claims_lock.
+        # Keyed by digest so raw bearer tokens are never held, and dropped once the token expires.
+        self.claims_cache = OrderedDict()
+        self.claims_lock = threading.Lock()
+        
+        # Bedrock: availability is checked once per process, the client is kept for ChatBedrock
+        self.bedrock_client = None
+        self.bedrock_checked = False
+        self.bedrock_ok = False
+        # LangChain agent, built on first Bedrock request
+        self.agent = None
+    
+    def health(self):
+        """Report the state of each resource (no network calls)"""
+        return {
+            "http_session": "ok" if self.http.adapters else "missing adapters",
+            "executor": "ok",
+            "bedrock_client": ("ready" if self.bedrock_ok else "unavailable") if self.bedrock_checked else "not checked",
+            "langchain_agent": "ready" if self.agent is not None else "not built",
+            "token_cache_entries": len(self.token_cache),
+            "weather_cache_entries": len(self.weather_cache),
+            "claims_cache_entries": len(self.claims_cache),
+        }
 
-# Store debug info (global for simplicity)
-debug_logs = []
+
+RES = AppResources()
+
+# Debug info for the current request (bounded deque, replaced by clear_debug() per request)
+DEBUG_LOG_MAX_ENTRIES = 200
+_debug_logs = contextvars.ContextVar('debug_logs', default=None)
+# Queue that mirrors log_debug() entries to /api/chat/stream while a streamed request runs.
+# A ContextVar, not a global: concurrent streams each see only their own queue, and
+# LangGraph copies the context into the threads that run tools.
+_debug_listener = contextvars.ContextVar('debug_listener', default=None)
+# Set DEBUG_LOG=1 to pretty-print full debug payloads to the console
+DEBUG_LOG = os.environ.get('DEBUG_LOG', '0') == '1'
+
+# Agent Identity tokens (RES.token_cache) are reused until this many seconds before they expire
+TOKEN_REFRESH_MARGIN_SECONDS = 60
+# In-flight background token fetch (Future), see prefetch_agent_token()
+_pending_token = None
+_pending_token_lock = threading.Lock()
 
 
 def log_debug(step, message, data=None):
@@ -55,56 +180,148 @@ def log_debug(step, message, data=None):
         "message": message,
         "data": data
     }
-    debug_logs.append(entry)
+    logs = _debug_logs.get()
+    if logs is not None:
+        logs.append(entry)
+    listener = _debug_listener.get()
+    if listener is not None:
+        listener.put(("debug", entry))
     print(f"[{step}] {message}")
     if data:
-        print(f"    Data: {json.dumps(data, indent=2)[:500]}")
+        if DEBUG_LOG:
+            print(f"    Data: {json.dumps(data, indent=2)[:500]}")
+        else:
+            print(f"    Data: {str(data)[:500]}")
 
 
 def clear_debug():
-    """Clear debug logs for new request"""
-    global debug_logs
-    debug_logs = []
+    """Start an empty debug log for the current request"""
+    _debug_logs.set(deque(maxlen=DEBUG_LOG_MAX_ENTRIES))
+
+
+def debug_snapshot():
+    """Debug entries logged so far in the current request"""
+    logs = _debug_logs.get()
+    return list(logs) if logs is not None else []
+
+
+CLAIMS_CACHE_MAX_ENTRIES = 32
 
 
 def decode_jwt_payload(token):
-    """Decode JWT payload (without verification) to display claims"""
+    """Decode JWT payload (without verification) to display claims.
+    Cached until the token's exp - callers must treat the returned dict as read-only."""
     try:
-        if token.startswith('Bearer '):
-            token = token[7:]
-        parts = token.split('.')
-        if len(parts) != 3:
+        token = token.removeprefix('Bearer ')
+        cache_key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+        now = time.time()
+        with RES.claims_lock:
+            cached = RES.claims_cache.get(cache_key)
+            if cached and now < cached[0]:
+                RES.claims_cache.move_to_end(cache_key)
+                return cached[1]
+        
+        parts = token.split('.', 2)
+        if len(parts) < 3:
             return None
         payload = parts[1]
-        padding = 4 - len(payload) % 4
-        if padding != 4:
-            payload += '=' * padding
+        payload += '=' * (-len(payload) % 4)
         decoded = base64.urlsafe_b64decode(payload)
-        return json.loads(decoded)
+        claims = json.loads(decoded)
+        
+        exp = claims.get('exp') if isinstance(claims, dict) else None
+        if isinstance(exp, (int, float)) and now < exp:
+            with RES.claims_lock:
+                RES.claims_cache[cache_key] = (exp, claims)
+                RES.claims_cache.move_to_end(cache_key)
+                while len(RES.claims_cache) > CLAIMS_CACHE_MAX_ENTRIES:
+                    RES.claims_cache.popitem(last=False)
+        return claims
     except Exception:
         return None
 
 
+def _cached_agent_token():
+    """Return the cached (authorization_header, exp) if it is still fresh, else None"""
+    cached = RES.token_cache.get(AGENT_APP_ID)
+    if cached and time.time() < cached[1] - TOKEN_REFRESH_MARGIN_SECONDS:
+        return cached
+    return None
+
+
+def _fetch_agent_token():
+    """Fetch a fresh autonomous token from the sidecar and cache it until exp.
+    No debug logging here - this also runs on the background prefetch thread."""
+    url = f"{SIDECAR_URL}/AuthorizationHeaderUnauthenticated/graph-app?AgentIdentity={AGENT_APP_ID}"
+    response = RES.http.get(url, timeout=30, headers={"Host": "localhost"})
+    response.raise_for_status()
+    
+    auth_header = response.json().get('authorizationHeader', '')
+    claims = decode_jwt_payload(auth_header) if auth_header else None
+    if claims and isinstance(claims.get('exp'), (int, float)):
+        RES.token_cache[AGENT_APP_ID] = (auth_header, claims['exp'])
+    return auth_header
+
+
+def _clear_pending_token(future):
+    global _pending_token
+    with _pending_token_lock:
+        if _pending_token is future:
+            _pending_token = None
+
+
+def prefetch_agent_token():
+    """Start fetching the autonomous token in the background so the tool finds it ready"""
+    global _pending_token
+    # Check-and-set under the lock so concurrent requests share one fetch
+    with _pending_token_lock:
+        if _pending_token is not None or _cached_agent_token() is not None:
+            return
+        future = _pending_token = RES.executor.submit(_fetch_agent_token)
+    # Outside the lock: the callback runs right here if the fetch has already finished
+    future.add_done_callback(_clear_pending_token)
+
+
 def get_agent_token():
-    """Get Agent Identity token from sidecar"""
+    """Get Agent Identity token from sidecar (cached until shortly before exp)"""
     log_debug("2.A TOKEN REQUEST", f"Requesting token for Agent: {AGENT_APP_ID}")
     
+    # A prefetch may already be in flight - wait for it rather than issuing a second request
+    pending = _pending_token
+    if pending is not None:
+        try:
+            pending.result(timeout=5)
+        except Exception:
+            pass  # fall back to a regular fetch below
+    
+    cached = _cached_agent_token()
+    if cached:
+        auth_header = cached[0]
+        claims = decode_jwt_payload(auth_header)
+        if claims:
+            _last_tr_claims.set(claims)
+            log_debug("2.C TOKEN RECEIVED", f"Reusing cached Agent Identity token (TR), expires in {int(cached[1] - time.time())}s", {
+                "_jwt_token": {
+                    "type": "tr",
+                    "title": "\U0001f512 TR \u2014 Autonomous Agent Token (App-Only / Client Credentials)",
+                    "css": "tr",
+                    "hl": "highlight-purple",
+                    "claims": claims
+                }
+            })
+        return auth_header
+    
     try:
         url = f"{SIDECAR_URL}/AuthorizationHeaderUnauthenticated/graph-app?AgentIdentity={AGENT_APP_ID}"
         log_debug("2.B REQUEST URL", f"Sidecar URL: {url}")
         
-        response = requests.get(url, timeout=30, headers={"Host": "localhost"})
-        response.raise_for_status()
-        
-        result = response.json()
-        auth_header = result.get('authorizationHeader', '')
+        auth_header = _fetch_agent_token()
         
         if auth_header:
             claims = decode_jwt_payload(auth_header)
             if claims:
-                global _last_tr_claims
                 # Pass through ALL claims from the JWT (same as OBO flow)
-                _last_tr_claims = claims
+                _last_tr_claims.set(claims)
                 log_debug("2.C TOKEN RECEIVED", "Got Agent Identity token (TR) from sidecar", {
                     "_jwt_token": {
                         "type": "tr",
@@ -183,7 +400,7 @@ def get_agent_token_obo(user_token=None):
                 "required_audience": f"api://{BLUEPRINT_APP_ID}" if BLUEPRINT_APP_ID else "api://<blueprint-client-id>"
             })
         
-        response = requests.get(url, timeout=30, headers=headers)
+        response = RES.http.get(url, timeout=30, headers=headers)
         
         if response.status_code == 200:
             result = response.json()
@@ -192,9 +409,8 @@ def get_agent_token_obo(user_token=None):
             if auth_header:
                 claims = decode_jwt_payload(auth_header)
                 if claims:
-                    global _last_tr_claims
                     # Pass through ALL claims from the JWT
-                    _last_tr_claims = claims
+                    _last_tr_claims.set(claims)
                     log_debug("OBO 2.D TOKEN RECEIVED", "Got delegated agent token (TR) via OBO exchange", {
                         "_jwt_token": {
                             "type": "tr",
@@ -230,12 +446,11 @@ def get_t1_token_claims():
     
     In the Autonomous flow, T1 IS the final token (returned by get_agent_token).
     """
+    cached = _cached_agent_token()
+    if cached:
+        return decode_jwt_payload(cached[0])
     try:
-        url = f"{SIDECAR_URL}/AuthorizationHeaderUnauthenticated/graph-app?AgentIdentity={AGENT_APP_ID}"
-        response = requests.get(url, timeout=30, headers={"Host": "localhost"})
-        response.raise_for_status()
-        result = response.json()
-        auth_header = result.get('authorizationHeader', '')
+        auth_header = _fetch_agent_token()
         if auth_header:
             return decode_jwt_payload(auth_header)
     except Exception:
@@ -266,7 +481,10 @@ def call_weather_api(city: str, token: str, token_label: str = "TR", is_obo: boo
             "why": f"Weather API validates {token_label} to authorize the agent's request"
         })
         
-        response = requests.get(url, headers=headers, timeout=10)
+        response = RES.http.get(url, headers=headers, timeout=10)
+        if response.status_code == 401 and not is_obo:
+            # Token may have been revoked before exp - drop it so the next fetch hits the sidecar
+            RES.token_cache.pop(AGENT_APP_ID, None)
         response.raise_for_status()
         
         weather_data = response.json()
@@ -281,10 +499,15 @@ def call_weather_api(city: str, token: str, token_label: str = "TR", is_obo: boo
 # ============================================
 # Weather Function (works with or without LangChain)
 # ============================================
-# Global holder for user_token when OBO mode is active (set per-request)
-_current_user_token = None
-# Store last TR (result token) claims for display
-_last_tr_claims = None
+# user_token when OBO mode is active - per request, since LangChain tools can't take extra params
+_current_user_token = contextvars.ContextVar('current_user_token', default=None)
+# Last TR (result token) claims for display, per request
+_last_tr_claims = contextvars.ContextVar('last_tr_claims', default=None)
+
+# Short-lived cache of formatted weather results (RES.weather_cache)
+# Only the autonomous flow is cached - OBO must always present the signed-in user's token.
+WEATHER_CACHE_TTL_SECONDS = 60
+WEATHER_CACHE_MAX_ENTRIES = 256
 
 
 def get_weather_data(city: str, user_token=None) -> str:
@@ -297,7 +520,18 @@ def get_weather_data(city: str, user_token=None) -> str:
     flow_label = "OBO" if is_obo else "Autonomous"
     log_debug("1. TOOL CALLED", f"Weather function called for city: {city} (flow: {flow_label})")
     
+    now = time.time()
+    cache_key = city.lower()
+    if not is_obo:
+        with RES.weather_lock:
+            cached = RES.weather_cache.get(cache_key)
+        if cached and now - cached[0] < WEATHER_CACHE_TTL_SECONDS:
+            log_debug("1. CACHE HIT", f"Reusing weather for {city} fetched {int(now - cached[0])}s ago")
+            return cached[1]
+    
     # Step 1: Get Agent Identity token from sidecar
+    # Only a token served from the cache can be stale enough to earn a retry below
+    token_was_cached = not is_obo and _cached_agent_token() is not None
     if is_obo:
         token = get_agent_token_obo(user_token=user_token)
     else:
@@ -309,6 +543,12 @@ def get_weather_data(city: str, user_token=None) -> str:
     # Step 2: Call Weather API with the token
     token_label = "TR"
     weather = call_weather_api(city, token, token_label=token_label, is_obo=is_obo)
+    if not weather and not is_obo and token_was_cached and AGENT_APP_ID not in RES.token_cache:
+        # Cached token was rejected (401) - retry once with a fresh token
+        log_debug("3. TOKEN RETRY", "Weather API rejected cached token - requesting a fresh one from sidecar")
+        token = get_agent_token()
+        if token:
+            weather = call_weather_api(city, token, token_label=token_label, is_obo=is_obo)
     if not weather:
         return f"Error: Could not get weather data for {city}. The API may have rejected the token."
     
@@ -325,6 +565,13 @@ def get_weather_data(city: str, user_token=None) -> str:
 - Token Flow: {flow_label}"""
     
     log_debug("4. TOOL RESULT", f"Weather data retrieved ({flow_label})", {"result": result})
+    
+    if not is_obo:
+        with RES.weather_lock:
+            RES.weather_cache[cache_key] = (now, result)
+            RES.weather_cache.move_to_end(cache_key)
+            while len(RES.weather_cache) > WEATHER_CACHE_MAX_ENTRIES:
+                RES.weather_cache.popitem(last=False)
     return result
 
 
@@ -346,7 +593,7 @@ if LANGCHAIN_AVAILABLE and tool is not None:
             Current weather including temperature, condition, humidity, wind speed.
         """
         # Check if OBO mode is active via global token holder
-        result = get_weather_data(city, user_token=_current_user_token)
+        result = get_weather_data(city, user_token=_current_user_token.get())
         return result
 
 
@@ -360,15 +607,31 @@ def create_weather_agent():
     print(f"[AWS] Model: {BEDROCK_MODEL_ID}")
     print(f"[AWS] Region: {AWS_REGION}")
     
-    # Initialize AWS Bedrock LLM
-    llm = ChatBedrock(
-        model_id=BEDROCK_MODEL_ID,
-        region_name=AWS_REGION,
-        model_kwargs={
-            "temperature": 0.7,
-            "max_tokens": 2048
-        }
-    )
+    # Initialize AWS Bedrock LLM - reuses the client from check_bedrock_available() when present
+    if BEDROCK_LATENCY_OPTIMIZED:
+        # performanceConfig is a Converse API request parameter; InvokeModel would get it
+        # as an unknown body field and reject every call
+        print(f"[AWS] Latency-optimized inference: enabled (Converse API)")
+        llm = ChatBedrockConverse(
+            model=BEDROCK_MODEL_ID,
+            region_name=AWS_REGION,
+            client=RES.bedrock_client,
+            config=BotoConfig(**BEDROCK_CLIENT_CONFIG),
+            temperature=0.7,
+            max_tokens=2048,
+            performance_config={"latency": "optimized"},
+        )
+    else:
+        llm = ChatBedrock(
+            model_id=BEDROCK_MODEL_ID,
+            region_name=AWS_REGION,
+            client=RES.bedrock_client,
+            config=BotoConfig(**BEDROCK_CLIENT_CONFIG),
+            model_kwargs={
+                "temperature": 0.7,
+                "max_tokens": 2048
+            },
+        )
     
     print(f"[AWS] ✓ ChatBedrock instance created successfully")
     
@@ -380,25 +643,61 @@ def create_weather_agent():
     llm_with_tools = llm.bind_tools(tools)
     
     # Use LangGraph ReAct agent
-    from langgraph.prebuilt import create_react_agent
     agent = create_react_agent(llm_with_tools, tools)
     
     return agent
 
 
+def get_weather_agent():
+    """Return the shared LangChain agent, creating it on first use.
+    Built once and reused across requests (ChatBedrock + LangGraph compile is not free)."""
+    if RES.agent is None:
+        RES.agent = create_weather_agent()
+    return RES.agent
+
+
+# create_react_agent ends the run with this message instead of a tool call it has no steps left for
+_NEED_MORE_STEPS = "Sorry, need more steps to process this request."
+
+
+def _run_agent(agent, system_msg, user_query: str):
+    """Run the ReAct graph and return its final state"""
+    # Limit recursion to prevent loops: agent -> tool -> agent needs 3 steps
+    result = {}
+    for state in agent.stream(
+        {"messages": [system_msg, ("human", user_query)]},
+        {"recursion_limit": 4},
+        stream_mode="values"
+    ):
+        result = state
+    
+    # A model that asks for a second tool call gets the step-limit message back instead of
+    # an answer - the first tool result is already in the state, so answer from that
+    messages = result.get("messages", [])
+    if messages and messages[-1].content == _NEED_MORE_STEPS:
+        last_tool = next((i for i in range(len(messages) - 1, -1, -1)
+                          if getattr(messages[i], "type", "") == "tool"), None)
+        if last_tool is not None:
+            log_debug("0. STEP LIMIT", "Agent requested another tool call past the step limit - answering from the last tool result")
+            result = {**result, "messages": messages[:last_tool + 1]}
+    return result
+
+
 def process_with_langchain(user_query: str):
     """Process query using LangChain agent with AWS Bedrock"""
-    global last_bedrock_call_time
-    
-    # Rate limiting - wait if needed
-    time_since_last_call = time.time() - last_bedrock_call_time
-    if time_since_last_call < BEDROCK_RATE_LIMIT_SECONDS:
-        wait_time = BEDROCK_RATE_LIMIT_SECONDS - time_since_last_call
+    # Rate limiting - wait only once the burst allowance is used up
+    wait_time = bedrock_bucket.acquire()
+    if wait_time > 0:
         log_debug("0. RATE LIMIT", f"Waiting {wait_time:.1f} seconds to avoid AWS throttling...")
         print(f"[AWS] Rate limit: waiting {wait_time:.1f} seconds...")
         time.sleep(wait_time)
     
     log_debug("0. START", f"User query: {user_query}")
+    
+    # Weather query in autonomous flow: fetch the agent token while Bedrock is thinking
+    if _current_user_token.get() is None and _WEATHER_QUERY.search(user_query):
+        prefetch_agent_token()
+    
     log_debug("0. BEDROCK", f"Sending query to AWS Bedrock (model: {BEDROCK_MODEL_ID})")
     
     print(f"\n{'='*60}")
@@ -409,20 +708,16 @@ def process_with_langchain(user_query: str):
     print(f"{'='*60}\n")
     
     try:
-        agent = create_weather_agent()
+        agent = get_weather_agent()
         log_debug("0. AGENT READY", f"LangChain agent created with AWS Bedrock ({BEDROCK_MODEL_ID})")
         
         print(f"[AWS] Invoking Bedrock API...")
         
         # Add system message to encourage ONE tool call
-        from langchain_core.messages import SystemMessage
         system_msg = SystemMessage(content="You have access to a get_weather tool. When users ask about weather, call the get_weather tool ONCE with the city name, then provide a natural response using the data returned. Do NOT call the tool multiple times.")
         
-        # Limit recursion to prevent infinite loops
-        result = agent.invoke(
-            {"messages": [system_msg, ("human", user_query)]},
-            {"recursion_limit": 10}  # Max 10 steps to prevent loops
-        )
+        # Throttling is retried inside botocore (adaptive mode), per Bedrock call
+        result = _run_agent(agent, system_msg, user_query)
         
         # Check messages for tool calls (just detection, no duplicate logging)
         messages = result.get("messages", [])
@@ -438,11 +733,10 @@ def process_with_langchain(user_query: str):
                     # Tool execution already logged everything, don't duplicate
         
         # Fallback: If LLM didn't call tool but query is about weather, manually call it
-        if not tool_called and any(keyword in user_query.lower() for keyword in ['weather', 'temperature', 'forecast', 'condition']):
+        if not tool_called and WEATHER_KEYWORDS.intersection(_WORD.findall(user_query.lower())):
             log_debug("1. FALLBACK", "LLM didn't call tool - manually extracting city and calling weather tool")
             
             # Extract city from query
-            import re
             clean_query = user_query.strip().rstrip('?').rstrip('.')
             words = clean_query.split()
             
@@ -478,12 +772,9 @@ def process_with_langchain(user_query: str):
         
         log_debug("5. COMPLETE", "AWS Bedrock agent finished processing")
         
-        # Update rate limit timestamp
-        last_bedrock_call_time = time.time()
-        
         return {
             "response": output,
-            "debug": debug_logs,
+            "debug": debug_snapshot(),
             "success": True,
             "agent_type": "bedrock"
         }
@@ -494,35 +785,70 @@ def process_with_langchain(user_query: str):
         log_debug("ERROR", f"AWS Bedrock agent failed: {str(e)}")
         return {
             "response": f"Agent error: {str(e)}",
-            "debug": debug_logs,
+            "debug": debug_snapshot(),
             "success": False,
             "agent_type": "bedrock"
         }
 
 
+# City extraction patterns (compiled once)
+_CITY_IN = re.compile(r'\bin\s+([A-Za-z][A-Za-z\s]*?)$', re.IGNORECASE)
+_CITY_FOR = re.compile(r'\bfor\s+([A-Za-z][A-Za-z\s]*?)$', re.IGNORECASE)
+_COMMON_WORDS = frozenset({'weather', 'what', 'is', 'the', 'how', 'today', 'now', 'like'})
+_WORD = re.compile(r'[a-z]+')
+WEATHER_KEYWORDS = frozenset({'weather', 'temperature', 'forecast', 'condition',
+                              'temperatures', 'forecasts', 'conditions'})
+_WEATHER_QUERY = re.compile(r'\b(?:weather|temperature|forecast)\b', re.IGNORECASE)
+
+
 def _extract_city(user_query: str) -> str:
     """Extract city name from a user query about weather."""
-    import re
     clean_query = user_query.strip().rstrip('?').rstrip('.')
     
-    match = re.search(r'\bin\s+([A-Za-z][A-Za-z\s]*?)$', clean_query, re.IGNORECASE)
+    match = _CITY_IN.search(clean_query)
     if match:
         return match.group(1).strip()
     
-    match = re.search(r'\bfor\s+([A-Za-z][A-Za-z\s]*?)$', clean_query, re.IGNORECASE)
+    match = _CITY_FOR.search(clean_query)
     if match:
         return match.group(1).strip()
     
     words = clean_query.split()
     if words:
         last_word = words[-1]
-        common_words = {'weather', 'what', 'is', 'the', 'how', 'today', 'now', 'like'}
-        if last_word.lower() not in common_words:
+        if last_word.lower() not in _COMMON_WORDS:
             return last_word
     
     return "Seattle"
 
 
+# Words that make a weather query more than "weather in <city>" - those go to the LLM
+_NOT_TRIVIAL_WORDS = frozenset({
+    'and', 'or', 'vs', 'versus', 'compare', 'compared', 'between', 'than',
+    'higher', 'lower', 'warmer', 'colder', 'hotter', 'cooler', 'better', 'worse',
+    'today', 'tonight', 'tomorrow', 'yesterday', 'now', 'later', 'next', 'last',
+    'week', 'weekend', 'morning', 'afternoon', 'evening', 'night', 'hour', 'hours', 'day', 'days',
+})
+_TRIVIAL_CITY_MAX_WORDS = 3
+
+
+def _is_trivial_weather(user_query: str) -> Optional[str]:
+    """Return the city if the query is an unambiguous 'weather in/for <City>' request, else None.
+    Only a short capitalized place name qualifies; anything else is left to the LLM."""
+    if not _WEATHER_QUERY.search(user_query):
+        return None
+    if _NOT_TRIVIAL_WORDS.intersection(_WORD.findall(user_query.lower())):
+        return None
+    clean_query = user_query.strip().rstrip('?').rstrip('.')
+    match = _CITY_IN.search(clean_query) or _CITY_FOR.search(clean_query)
+    if not match:
+        return None
+    words = match.group(1).split()
+    if not words or len(words) > _TRIVIAL_CITY_MAX_WORDS or not all(w[0].isupper() for w in words):
+        return None
+    return " ".join(words)
+
+
 def process_without_llm(user_query: str, user_token=None):
     """Process query without LLM (direct tool call).
     If user_token is provided, uses OBO flow."""
@@ -552,7 +878,7 @@ def process_without_llm(user_query: str, user_token=None):
     
     return {
         "response": response,
-        "debug": debug_logs,
+        "debug": debug_snapshot(),
         "success": True,
         "agent_type": "direct",
         "token_flow": "obo" if is_obo else "autonomous"
@@ -560,18 +886,24 @@ def process_without_llm(user_query: str, user_token=None):
 
 
 def check_bedrock_available():
-    """Check if AWS credentials are configured"""
+    """Check if AWS credentials are configured (cached after the first call)"""
+    if RES.bedrock_checked:
+        return RES.bedrock_ok
     try:
         import boto3
+        from botocore.config import Config
         # Try to create a bedrock-runtime client
         print(f"[AWS] Checking Bedrock availability in region: {AWS_REGION}")
-        bedrock = boto3.client('bedrock-runtime', region_name=AWS_REGION)
+        RES.bedrock_client = boto3.client('bedrock-runtime', region_name=AWS_REGION,
+                                          config=Config(**BEDROCK_CLIENT_CONFIG))
         print(f"[AWS] ✓ Bedrock client created successfully")
         print(f"[AWS] Using credentials: {os.environ.get('AWS_ACCESS_KEY_ID', 'NOT SET')[:8]}...")
-        return True
+        RES.bedrock_ok = True
     except Exception as e:
         print(f"[AWS] ✗ Bedrock not available: {e}")
-        return False
+        RES.bedrock_ok = False
+    RES.bedrock_checked = True
+    return RES.bedrock_ok
 
 
 # ============================================
@@ -579,13 +911,19 @@ def check_bedrock_available():
 # ============================================
 @app.route('/')
 def index():
-    """Serve the chat UI"""
-    return render_template_string(CHAT_UI_TEMPLATE)
+    """Serve the chat UI (pre-rendered and gzipped at startup)"""
+    if 'gzip' in request.accept_encodings:
+        response = Response(_CHAT_UI_GZ, mimetype='text/html')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(_CHAT_UI_HTML, mimetype='text/html')
+    response.headers['Cache-Control'] = 'public, max-age=300'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
 
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
-    """Handle chat messages.
+def handle_chat(data):
+    """Run one chat turn and return (response_dict, http_status).
     
     Accepts:
         message: str - user query
@@ -593,24 +931,22 @@ def chat():
         token_flow: 'autonomous' | 'obo' - token acquisition flow
         user_token: str | null - MSAL user access token (required for OBO)
     """
-    global _current_user_token
-    data = request.json
     user_message = data.get('message', '')
     llm_mode = data.get('llm_mode', data.get('mode', 'direct'))  # backward compat
     token_flow = data.get('token_flow', 'autonomous')
     user_token = data.get('user_token', None)
     
     if not user_message:
-        return jsonify({"error": "No message provided"}), 400
+        return {"error": "No message provided"}, 400
     
     # For OBO flow, user_token is required
     if token_flow == 'obo' and not user_token:
-        return jsonify({"error": "OBO flow requires a user token. Please sign in first."}), 400
+        return {"error": "OBO flow requires a user token. Please sign in first."}, 400
     
-    # Set global token for LangChain tool access (tools can't receive params directly)
-    global _last_tr_claims
-    _current_user_token = user_token if token_flow == 'obo' else None
-    _last_tr_claims = None  # Reset for each request
+    # Per-request token for LangChain tool access (tools can't receive params directly)
+    obo_token = user_token if token_flow == 'obo' else None
+    token_reset = _current_user_token.set(obo_token)
+    _last_tr_claims.set(None)  # Reset for each request
     clear_debug()  # Clear debug logs at start of each request
     
     # Decode Tc (user token) claims for display — pass ALL claims
@@ -628,22 +964,30 @@ def chat():
                 }
             })
     
+    # T1 claims are display-only and independent of the flow - fetch them in the background
+    t1_future = RES.executor.submit(get_t1_token_claims) if token_flow == 'obo' else None
+    
     try:
-        if llm_mode == 'bedrock' and LANGCHAIN_AVAILABLE and check_bedrock_available():
+        use_bedrock = llm_mode == 'bedrock' and LANGCHAIN_AVAILABLE and check_bedrock_available()
+        if use_bedrock and not AGENT_FORCE_LLM and (city := _is_trivial_weather(user_message)):
+            # Fast path: city is explicit, so skip the Bedrock round-trip
+            log_debug("0. FAST PATH", f"Query names the city explicitly ({city}) - calling the tool without Bedrock")
+            result = process_without_llm(user_message, user_token=obo_token)
+        elif use_bedrock:
             result = process_with_langchain(user_message)
             # Override agent_type to reflect both dimensions
             result['token_flow'] = token_flow
         else:
-            result = process_without_llm(user_message, user_token=_current_user_token)
+            result = process_without_llm(user_message, user_token=obo_token)
     finally:
-        _current_user_token = None  # Always clear after request
+        _current_user_token.reset(token_reset)  # Always clear after request
     
     # Attach token claims for display (both OBO and Autonomous)
     # Note: full JWT claims are now embedded directly in debug log entries
     # (Tc at step OBO 0.A, T1 inserted before TR, TR at step OBO 2.D)
     if token_flow == 'obo':
         # Fetch T1 claims and insert into debug log BEFORE the TR entry
-        t1_claims = get_t1_token_claims()
+        t1_claims = t1_future.result()
         if t1_claims:
             t1_entry = {
                 "step": "OBO 2.C T1 (Blueprint)",
@@ -664,7 +1008,7 @@ def chat():
                 result['debug'].insert(tr_idx, t1_entry)
             else:
                 result['debug'].append(t1_entry)
-    _last_tr_claims = None
+    _last_tr_claims.set(None)
     
     # Add doc links entry at end of debug flow
     result['debug'].append({
@@ -673,7 +1017,45 @@ def chat():
         "data": None
     })
     
-    return jsonify(result)
+    return result, 200
+
+
+@app.route('/api/chat', methods=['POST'])
+def chat():
+    """Handle chat messages (see handle_chat for the request fields)"""
+    result, status_code = handle_chat(request.json)
+    return jsonify(result), status_code
+
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Handle chat messages as Server-Sent Events.
+    
+    Emits one 'debug' event per log_debug() entry as the flow runs, then a final
+    'result' event with the same payload /api/chat would return.
+    """
+    data = request.json
+    events = queue.Queue()
+    
+    def worker():
+        # Runs in a fresh thread, so the listener is only visible to this request
+        _debug_listener.set(events)
+        try:
+            result, _ = handle_chat(data)
+        except Exception as e:
+            result = {"error": f"Agent error: {str(e)}"}
+        events.put(("result", result))
+    
+    def generate():
+        threading.Thread(target=worker, daemon=True).start()
+        while True:
+            event, payload = events.get()
+            yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+            if event == "result":
+                break
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 @app.route('/api/status', methods=['GET'])
@@ -716,7 +1098,8 @@ def health():
     return jsonify({
         "status": "healthy",
         "service": "LLM Weather Agent (AWS Bedrock)",
-        "agent_app_id": AGENT_APP_ID[:8] + "..." if AGENT_APP_ID else "not set"
+        "agent_app_id": AGENT_APP_ID[:8] + "..." if AGENT_APP_ID else "not set",
+        "resources": RES.health()
     })
 
 
@@ -1314,6 +1697,52 @@ CHAT_UI_TEMPLATE = '''
         // ==============================
         // Send message
         // ==============================
+        // POST to /api/chat/stream and read Server-Sent Events from the response body.
+        // Renders each 'debug' event as it arrives and resolves with the final 'result' payload,
+        // or with null when the stream could not be started (the caller then uses /api/chat).
+        async function streamChat(body, signal) {
+            let response;
+            try {
+                response = await fetch('/api/chat/stream', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify(body),
+                    signal: signal
+                });
+            } catch (error) {
+                if (error.name === 'AbortError') throw error;
+                return null;
+            }
+            if (!response.ok || !response.body) return null;
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            const liveEntries = [];
+            let buffer = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                let sep;
+                while ((sep = buffer.indexOf('\\n\\n')) !== -1) {
+                    const raw = buffer.slice(0, sep);
+                    buffer = buffer.slice(sep + 2);
+                    let event = 'message', payload = '';
+                    raw.split('\\n').forEach(line => {
+                        if (line.startsWith('event: ')) event = line.slice(7);
+                        else if (line.startsWith('data: ')) payload += line.slice(6);
+                    });
+                    const parsed = JSON.parse(payload);
+                    if (event === 'result') return parsed;
+                    if (event === 'debug') {
+                        liveEntries.push(parsed);
+                        updateDebug(liveEntries);
+                    }
+                }
+            }
+            throw new Error('Stream ended without a result');
+        }
+
         async function sendMessage() {
             const message = userInput.value.trim();
             if (!message) return;
@@ -1350,16 +1779,19 @@ CHAT_UI_TEMPLATE = '''
                     body.user_token = currentUserToken;
                 }
 
-                const response = await fetch('/api/chat', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify(body),
-                    signal: controller.signal
-                });
+                // Stream debug steps as they happen; falls back to /api/chat only if the stream failed to start
+                let data = await streamChat(body, controller.signal);
+                if (data === null) {
+                    const response = await fetch('/api/chat', {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify(body),
+                        signal: controller.signal
+                    });
+                    data = await response.json();
+                }
                 clearTimeout(timeoutId);
 
-                const data = await response.json();
-
                 if (data.error) {
                     addMessage('Error: ' + data.error, false);
                 } else {
@@ -1429,6 +1861,10 @@ CHAT_UI_TEMPLATE = '''
 </html>
 '''
 
+# Template has no per-request context - render and gzip it once
+_CHAT_UI_HTML = app.jinja_env.from_string(CHAT_UI_TEMPLATE).render().encode('utf-8')
+_CHAT_UI_GZ = gzip.compress(_CHAT_UI_HTML, compresslevel=9)
+
 
 if __name__ == '__main__':
     print("=" * 60)
@@ -1443,4 +1879,5 @@ if __name__ == '__main__':
     print("  Open http://localhost:3001 in your browser")
     print("=" * 60)
     
-    app.run(host='0.0.0.0', port=3000, debug=True)
+    # Debugger/reloader only on request (FLASK_DEV=1) - they slow every request
+    app.run(host='0.0.0.0', port=3000, debug=os.environ.get('FLASK_DEV') == '1', threaded=True)
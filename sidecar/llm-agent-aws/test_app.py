@@ -0,0 +1,89 @@
+"""
+Tests for the Bedrock agent - run from this directory with: python -m unittest
+Bedrock is replaced by a stub client, so no AWS credentials or network are needed.
+"""
+
+import io
+import json
+import unittest
+from unittest import mock
+
+import app
+
+
+def converse_text(text):
+    """Converse API response carrying a plain text answer"""
+    return {
+        "output": {"message": {"role": "assistant", "content": [{"text": text}]}},
+        "stopReason": "end_turn",
+        "usage": {"inputTokens": 1, "outputTokens": 1, "totalTokens": 2},
+        "metrics": {"latencyMs": 1},
+    }
+
+
+def invoke_model_response(*content):
+    """InvokeModel response for an Anthropic Messages API reply"""
+    tool_use = any(block["type"] == "tool_use" for block in content)
+    body = {
+        "id": "msg_test",
+        "type": "message",
+        "role": "assistant",
+        "content": list(content),
+        "stop_reason": "tool_use" if tool_use else "end_turn",
+        "usage": {"input_tokens": 1, "output_tokens": 1},
+    }
+    return {"body": io.BytesIO(json.dumps(body).encode()), "ResponseMetadata": {"HTTPHeaders": {}}}
+
+
+def tool_use(tool_id, city):
+    return {"type": "tool_use", "id": tool_id, "name": "get_weather", "input": {"city": city}}
+
+
+def with_client(chat_model_cls, client):
+    """Wrap a langchain-aws chat model class so every instance talks to the stub client"""
+    return lambda **kwargs: chat_model_cls(**{**kwargs, "client": client})
+
+
+@unittest.skipUnless(app.LANGCHAIN_AVAILABLE, "LangChain / langchain-aws not installed")
+class LatencyOptimizedTest(unittest.TestCase):
+    def test_performance_config_is_a_request_parameter(self):
+        client = mock.MagicMock()
+        client.converse.return_value = converse_text("Hello")
+        with mock.patch.object(app, "BEDROCK_LATENCY_OPTIMIZED", True), \
+                mock.patch.object(app, "ChatBedrockConverse", with_client(app.ChatBedrockConverse, client)):
+            agent = app.create_weather_agent()
+            agent.invoke({"messages": [("human", "hello")]})
+
+        client.invoke_model.assert_not_called()
+        request = client.converse.call_args.kwargs
+        self.assertEqual(request["performanceConfig"], {"latency": "optimized"})
+        self.assertNotIn("performance_config", request.get("additionalModelRequestFields") or {})
+
+
+@unittest.skipUnless(app.LANGCHAIN_AVAILABLE, "LangChain / langchain-aws not installed")
+class StepLimitTest(unittest.TestCase):
+    def test_second_tool_call_answers_from_first_tool_result(self):
+        client = mock.MagicMock()
+        # The model asks for the tool twice; the second request runs into the step limit
+        client.invoke_model.side_effect = [
+            invoke_model_response({"type": "text", "text": "Let me check."}, tool_use("toolu_1", "Seattle")),
+            invoke_model_response({"type": "text", "text": "Let me check again."}, tool_use("toolu_2", "Seattle")),
+        ]
+        weather = "Weather for Seattle:\n- Temperature: 55°F"
+        with mock.patch.object(app, "BEDROCK_LATENCY_OPTIMIZED", False), \
+                mock.patch.object(app, "ChatBedrock", with_client(app.ChatBedrock, client)), \
+                mock.patch.object(app, "get_weather_agent", app.create_weather_agent), \
+                mock.patch.object(app.bedrock_bucket, "acquire", return_value=0.0), \
+                mock.patch.object(app, "get_weather_data", return_value=weather) as get_weather_data:
+            app.clear_debug()
+            result = app.process_with_langchain("What's the weather in Seattle?")
+
+        self.assertEqual(client.invoke_model.call_count, 2)
+        get_weather_data.assert_called_once_with("Seattle", user_token=None)
+        self.assertTrue(result["success"])
+        self.assertEqual(result["response"], weather)
+        self.assertIn("0. STEP LIMIT", [entry["step"] for entry in result["debug"]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -917,4 +917,5 @@ if __name__ == '__main__':
     print("  Open http://localhost:3002 in your browser")
     print("=" * 60)
     
-    app.run(host='0.0.0.0', port=3000, debug=True)
+    # Debugger/reloader only on request (FLASK_DEV=1) - they slow every request
+    app.run(host='0.0.0.0', port=3000, debug=os.environ.get('FLASK_DEV') == '1', threaded=True)
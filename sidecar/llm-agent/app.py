@@ -5,45 +5,63 @@ This agent demonstrates how an AI agent uses tools with Agent Identity tokens.
 
 import os
 import json
+import queue
 import base64
+import gzip
+import hashlib
+import re
+import reprlib
+import socket
+import tempfile
+from collections import defaultdict, deque
 import requests
-from flask import Flask, request, jsonify, render_template_string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import Flask, Response, g, has_app_context, request, jsonify, send_file
 from flask_cors import CORS
 
-# LangChain imports - using try/except for graceful fallback
-LANGCHAIN_AVAILABLE = False
-ChatOllama = None
-tool = None
-AgentExecutor = None
-create_tool_calling_agent = None
-ChatPromptTemplate = None
+# Brotli is optional - the UI falls back to gzip when it isn't installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
+# orjson is optional - faster JSON decoding, stdlib json otherwise
 try:
-    from langchain_ollama import ChatOllama
-    from langchain_core.tools import tool
-    from langchain.agents import AgentExecutor
-    from langchain.agents import create_tool_calling_agent
-    from langchain_core.prompts import ChatPromptTemplate
-    LANGCHAIN_AVAILABLE = True
-    print("LangChain loaded successfully")
-except ImportError as e:
-    # Try alternative import paths for newer LangChain versions
-    try:
-        from langchain_ollama import ChatOllama
-        from langchain_core.tools import tool
-        from langchain_core.prompts import ChatPromptTemplate
-        from langgraph.prebuilt import create_react_agent
-        # Use simpler ReAct agent pattern
-        LANGCHAIN_AVAILABLE = "react"
-        print("LangChain loaded with ReAct agent")
-    except ImportError as e2:
-        print(f"LangChain not fully available: {e}")
-        print(f"ReAct also failed: {e2}")
-        print("Running in direct mode only")
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    orjson = None
+    _json_loads = json.loads
+
+# LangChain is imported lazily by load_langchain() - direct mode never pays the import cost.
+# None = not probed yet, False = unavailable, True = AgentExecutor, "react" = LangGraph ReAct
+LANGCHAIN_AVAILABLE = None
+_LANGCHAIN = {}
+_LANGCHAIN_LOCK = threading.Lock()
 
 app = Flask(__name__)
 CORS(app)
 
+
+if orjson is not None:
+    from flask.json.provider import DefaultJSONProvider
+    
+    class ORJSONProvider(DefaultJSONProvider):
+        """Flask JSON provider backed by orjson (C encoder, falls back to Flask's default() hook)"""
+        
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+        
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+    
+    app.json = ORJSONProvider(app)
+
 # Configuration
 SIDECAR_URL = os.environ.get('SIDECAR_URL', 'http://sidecar:5000')
 WEATHER_API_URL = os.environ.get('WEATHER_API_URL', 'http://weather-api:8080')
@@ -51,8 +69,72 @@ AGENT_APP_ID = os.environ.get('AGENT_APP_ID', '')
 OLLAMA_URL = os.environ.get('OLLAMA_URL', 'http://ollama:11434')
 OLLAMA_MODEL = os.environ.get('OLLAMA_MODEL', 'llama3.2')
 
-# Store debug info (global for simplicity)
-debug_logs = []
+# Shared HTTP session - keep-alive connections to sidecar, Weather API and Ollama
+_SESSION = requests.Session()
+_SESSION.mount('http://', HTTPAdapter(pool_connections=16, pool_maxsize=64,
+                                      max_retries=Retry(total=2, backoff_factor=0.1)))
+_SESSION.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=64,
+                                       max_retries=Retry(total=2, backoff_factor=0.1)))
+_SESSION.headers.update({'Accept': 'application/json'})
+
+# Sidecar/Weather API hostnames are resolved up front and re-resolved every DNS_REFRESH_SECONDS,
+# so new connections skip the container resolver: base URL -> (IP-based base URL, Host header)
+DNS_REFRESH_SECONDS = 60
+_PINNED_URLS = {}
+
+
+def _pin_url(base_url):
+    """Swap the hostname in an http:// base URL for its IP; returns (url, original host or None)"""
+    parts = urlsplit(base_url)
+    if parts.scheme != 'http' or not parts.hostname:
+        return base_url, None
+    try:
+        ip = socket.gethostbyname(parts.hostname)
+    except OSError:
+        return base_url, None
+    netloc = f"{ip}:{parts.port}" if parts.port else ip
+    return urlunsplit(parts._replace(netloc=netloc)), parts.netloc
+
+
+def _refresh_pinned_urls():
+    for base_url in (SIDECAR_URL, WEATHER_API_URL):
+        _PINNED_URLS[base_url] = _pin_url(base_url)
+
+
+def _dns_refresh_loop():
+    while True:
+        time.sleep(DNS_REFRESH_SECONDS)
+        _refresh_pinned_urls()
+
+
+def pinned_url(base_url):
+    """Return (IP-based base URL, Host header or None) for SIDECAR_URL / WEATHER_API_URL"""
+    return _PINNED_URLS.get(base_url, (base_url, None))
+
+
+_refresh_pinned_urls()
+threading.Thread(target=_dns_refresh_loop, daemon=True).start()
+
+# Background workers for outbound calls that can overlap the LLM round-trip
+_EXECUTOR = ThreadPoolExecutor(max_workers=8)
+# Agent Identity token cache: AGENT_APP_ID -> (authorization_header, exp)
+_TOKEN_CACHE = {}
+_TOKEN_LOCK = threading.Lock()
+TOKEN_REFRESH_MARGIN_SECONDS = 60
+# In-flight background token fetch (Future), shared by all requests until it completes
+_pending_token = None
+_pending_token_lock = threading.Lock()
+
+# Debug info is collected per request in g.debug_logs (see chat())
+DEBUG_LOG_MAX_ENTRIES = 200
+
+# Console preview of debug payloads - sizes are capped while formatting, not after
+_DATA_REPR = reprlib.Repr()
+_DATA_REPR.maxlevel = 3
+_DATA_REPR.maxdict = 12
+_DATA_REPR.maxlist = 8
+_DATA_REPR.maxstring = 120
+_DATA_REPR.maxother = 120
 
 
 def log_debug(step, message, data=None):
@@ -62,65 +144,106 @@ def log_debug(step, message, data=None):
         "message": message,
         "data": data
     }
-    debug_logs.append(entry)
+    if has_app_context():
+        logs = g.get('debug_logs')
+        if logs is not None:
+            logs.append(entry)
+        # /api/chat/stream forwards entries to the browser as they happen
+        listener = g.get('debug_listener')
+        if listener is not None:
+            listener.put(("debug", entry))
     print(f"[{step}] {message}")
     if data:
-        print(f"    Data: {json.dumps(data, indent=2)[:500]}")
-
-
-def clear_debug():
-    """Clear debug logs for new request"""
-    global debug_logs
-    debug_logs = []
+        print(f"    Data: {_DATA_REPR.repr(data)[:500]}")
 
 
 def decode_jwt_payload(token):
     """Decode JWT payload (without verification) to display claims"""
     try:
-        if token.startswith('Bearer '):
+        if token[:7] == 'Bearer ':
             token = token[7:]
-        parts = token.split('.')
-        if len(parts) != 3:
-            return None
-        payload = parts[1]
-        padding = 4 - len(payload) % 4
-        if padding != 4:
-            payload += '=' * padding
-        decoded = base64.urlsafe_b64decode(payload)
-        return json.loads(decoded)
+        _, payload, _ = token.split('.', 2)
+        # base64 ignores surplus padding, so always appending '===' is safe
+        return _json_loads(base64.urlsafe_b64decode(payload + '==='))
     except Exception:
         return None
 
 
+def _fetch_agent_token():
+    """Call the sidecar for an Agent Identity token and cache it until exp
+    (no debug logging - may run on a worker thread)"""
+    base_url, _ = pinned_url(SIDECAR_URL)
+    url = f"{base_url}/AuthorizationHeaderUnauthenticated/graph?AgentIdentity={AGENT_APP_ID}"
+    response = _SESSION.get(url, timeout=30, headers={"Host": "localhost"})
+    response.raise_for_status()
+    
+    auth_header = response.json().get('authorizationHeader', '')
+    claims = decode_jwt_payload(auth_header) if auth_header else None
+    if claims and isinstance(claims.get("exp"), (int, float)):
+        with _TOKEN_LOCK:
+            _TOKEN_CACHE[AGENT_APP_ID] = (auth_header, claims["exp"])
+    return auth_header
+
+
+def _cached_agent_token():
+    """Return the cached authorization header if it is not about to expire, else None"""
+    with _TOKEN_LOCK:
+        cached = _TOKEN_CACHE.get(AGENT_APP_ID)
+    if cached and time.time() < cached[1] - TOKEN_REFRESH_MARGIN_SECONDS:
+        return cached[0]
+    return None
+
+
+def _clear_pending_token(future):
+    global _pending_token
+    with _pending_token_lock:
+        if _pending_token is future:
+            _pending_token = None
+
+
+def prefetch_agent_token():
+    """Start fetching the agent token in the background so the tool finds it ready"""
+    global _pending_token
+    # Check-and-set under the lock so concurrent requests share one fetch
+    with _pending_token_lock:
+        if _pending_token is not None or _cached_agent_token() is not None:
+            return
+        future = _pending_token = _EXECUTOR.submit(_fetch_agent_token)
+    # Outside the lock: the callback runs right here if the fetch has already finished
+    future.add_done_callback(_clear_pending_token)
+
+
 def get_agent_token():
-    """Get Agent Identity token from sidecar"""
+    """Get Agent Identity token from sidecar (cached until shortly before exp)"""
     log_debug("2. TOKEN REQUEST", f"LangChain tool requesting token for Agent: {AGENT_APP_ID}")
     
+    # A prefetch may already be in flight - wait for it rather than issuing a second request
+    pending = _pending_token
+    if pending is not None:
+        try:
+            pending.result(timeout=30)
+        except Exception:
+            pass  # fall back to a regular fetch below
+    
+    debug_enabled = not has_app_context() or g.get('debug_enabled', True)
+    auth_header = _cached_agent_token()
+    if auth_header:
+        # Claims are only decoded for the debug panel here - the cache already holds exp
+        claims = decode_jwt_payload(auth_header) if debug_enabled else None
+        if claims:
+            log_debug("2. TOKEN RECEIVED", "Reusing cached Agent Identity token", {"jwt_claims": _display_claims(claims)})
+        return auth_header
+    
     try:
         url = f"{SIDECAR_URL}/AuthorizationHeaderUnauthenticated/graph?AgentIdentity={AGENT_APP_ID}"
         log_debug("2. TOKEN REQUEST", f"Sidecar URL: {url}")
         
-        response = requests.get(url, timeout=30, headers={"Host": "localhost"})
-        response.raise_for_status()
-        
-        result = response.json()
-        auth_header = result.get('authorizationHeader', '')
+        auth_header = _fetch_agent_token()
         
-        if auth_header:
+        if auth_header and debug_enabled:
             claims = decode_jwt_payload(auth_header)
             if claims:
-                display_claims = {
-                    "aud": claims.get("aud", "N/A"),
-                    "iss": claims.get("iss", "N/A"),
-                    "app_displayname": claims.get("app_displayname", "N/A"),
-                    "appid": claims.get("appid", "N/A"),
-                    "oid": claims.get("oid", "N/A"),
-                    "roles": claims.get("roles", []),
-                    "tid": claims.get("tid", "N/A"),
-                    "exp": claims.get("exp", "N/A"),
-                    "iat": claims.get("iat", "N/A"),
-                }
-                log_debug("2. TOKEN RECEIVED", "Got Agent Identity token from sidecar", {"jwt_claims": display_claims})
+                log_debug("2. TOKEN RECEIVED", "Got Agent Identity token from sidecar", {"jwt_claims": _display_claims(claims)})
         
         return auth_header
     except Exception as e:
@@ -128,6 +251,21 @@ def get_agent_token():
         return None
 
 
+def _display_claims(claims):
+    """Pick the JWT claims shown in the debug panel"""
+    return {
+        "aud": claims.get("aud", "N/A"),
+        "iss": claims.get("iss", "N/A"),
+        "app_displayname": claims.get("app_displayname", "N/A"),
+        "appid": claims.get("appid", "N/A"),
+        "oid": claims.get("oid", "N/A"),
+        "roles": claims.get("roles", []),
+        "tid": claims.get("tid", "N/A"),
+        "exp": claims.get("exp", "N/A"),
+        "iat": claims.get("iat", "N/A"),
+    }
+
+
 def call_weather_api(city: str, token: str):
     """Call Weather API with Agent Identity token"""
     log_debug("3. WEATHER API", f"Calling Weather API for: {city}")
@@ -138,7 +276,10 @@ def call_weather_api(city: str, token: str):
         
         log_debug("3. WEATHER API", f"URL: {url}", {"headers": "Authorization: Bearer <token>"})
         
-        response = requests.get(url, headers=headers, timeout=10)
+        base_url, host = pinned_url(WEATHER_API_URL)
+        if host:
+            headers["Host"] = host
+        response = _SESSION.get(f"{base_url}/weather?city={city}", headers=headers, timeout=10)
         response.raise_for_status()
         
         weather_data = response.json()
@@ -153,6 +294,25 @@ def call_weather_api(city: str, token: str):
 # ============================================
 # Weather Function (works with or without LangChain)
 # ============================================
+# Tool output template; missing fields fall back to _WEATHER_DEFAULTS, then 'N/A'
+_WEATHER_TEMPLATE = """Weather for {city}:
+- Temperature: {temperature}°{temperature_unit}
+- Condition: {condition}
+- Humidity: {humidity}%
+- Wind Speed: {wind_speed} {wind_unit}
+- Timestamp: {timestamp} ({timezone})
+- Data Source: {data_source}
+- Authentication: Validated by {validated_by}
+- Agent App ID: {agent_app_id}"""
+_WEATHER_DEFAULTS = {
+    'temperature_unit': 'F',
+    'wind_unit': 'mph',
+    'timezone': 'UTC',
+    'data_source': 'Weather API',
+    'validated_by': 'Agent Identity Token',
+}
+
+
 def get_weather_data(city: str) -> str:
     """
     Get the current weather for a city.
@@ -171,45 +331,102 @@ def get_weather_data(city: str) -> str:
         return f"Error: Could not get weather data for {city}. The API may have rejected the token."
     
     # Step 3: Format response
-    result = f"""Weather for {weather.get('city', city)}:
-- Temperature: {weather.get('temperature', 'N/A')}°{weather.get('temperature_unit', 'F')}
-- Condition: {weather.get('condition', 'N/A')}
-- Humidity: {weather.get('humidity', 'N/A')}%
-- Wind Speed: {weather.get('wind_speed', 'N/A')} {weather.get('wind_unit', 'mph')}
-- Timestamp: {weather.get('timestamp', 'N/A')} ({weather.get('timezone', 'UTC')})
-- Data Source: {weather.get('data_source', 'Weather API')}
-- Authentication: Validated by {weather.get('validated_by', 'Agent Identity Token')}
-- Agent App ID: {weather.get('agent_app_id', 'N/A')}"""
-    
-    log_debug("4. TOOL RESULT", "Weather data retrieved", {"result": result})
+    view = defaultdict(lambda: 'N/A', _WEATHER_DEFAULTS, city=city)
+    view.update(weather)
+    result = _WEATHER_TEMPLATE.format_map(view)
+    
+    # The formatted text is derived from the step 3 payload (and returned in the response),
+    # so don't repeat it in the debug log
+    log_debug("4. TOOL RESULT", f"Weather data retrieved ({len(result)} chars formatted from step 3)")
     return result
 
 
-# Create LangChain tool wrapper if available
-if LANGCHAIN_AVAILABLE and tool is not None:
-    @tool
-    def get_weather(city: str) -> str:
-        """
-        Get the current weather for a city. Use this tool when the user asks about weather.
-        This tool uses Agent Identity to securely authenticate with the Weather API.
-        
-        Args:
-            city: The name of the city to get weather for (e.g., "Seattle", "New York", "London")
-        
-        Returns:
-            Weather information including temperature, condition, and humidity.
-        """
-        return get_weather_data(city)
+# Wrapped as a LangChain tool by load_langchain() (the docstring is the tool description)
+def get_weather(city: str) -> str:
+    """
+    Get the current weather for a city. Use this tool when the user asks about weather.
+    This tool uses Agent Identity to securely authenticate with the Weather API.
+    
+    Args:
+        city: The name of the city to get weather for (e.g., "Seattle", "New York", "London")
+    
+    Returns:
+        Weather information including temperature, condition, and humidity.
+    """
+    return get_weather_data(city)
 
 
 # ============================================
 # LangChain Agent Setup
 # ============================================
+def _token_forwarder_class(base):
+    """Build a LangChain callback handler that pushes LLM tokens to a /api/chat/stream listener"""
+    class TokenForwarder(base):
+        def __init__(self, listener):
+            super().__init__()
+            self.listener = listener
+        
+        def on_llm_new_token(self, token, **kwargs):
+            if token:
+                self.listener.put(("token", {"text": token}))
+    
+    return TokenForwarder
+
+
+def load_langchain():
+    """Import LangChain on first use and return LANGCHAIN_AVAILABLE"""
+    global LANGCHAIN_AVAILABLE
+    if LANGCHAIN_AVAILABLE is not None:
+        return LANGCHAIN_AVAILABLE
+    with _LANGCHAIN_LOCK:
+        if LANGCHAIN_AVAILABLE is not None:
+            return LANGCHAIN_AVAILABLE
+        try:
+            from langchain_ollama import ChatOllama
+            from langchain_core.tools import tool
+            from langchain.agents import AgentExecutor
+            from langchain.agents import create_tool_calling_agent
+            from langchain_core.prompts import ChatPromptTemplate
+            from langchain_core.callbacks import BaseCallbackHandler
+            _LANGCHAIN.update(
+                ChatOllama=ChatOllama,
+                AgentExecutor=AgentExecutor,
+                create_tool_calling_agent=create_tool_calling_agent,
+                ChatPromptTemplate=ChatPromptTemplate,
+                weather_tool=tool(get_weather),
+                TokenForwarder=_token_forwarder_class(BaseCallbackHandler),
+            )
+            mode = True
+            print("LangChain loaded successfully")
+        except ImportError as e:
+            # Try alternative import paths for newer LangChain versions
+            try:
+                from langchain_ollama import ChatOllama
+                from langchain_core.tools import tool
+                from langgraph.prebuilt import create_react_agent
+                # Use simpler ReAct agent pattern
+                _LANGCHAIN.update(
+                    ChatOllama=ChatOllama,
+                    create_react_agent=create_react_agent,
+                    weather_tool=tool(get_weather),
+                )
+                mode = "react"
+                print("LangChain loaded with ReAct agent")
+            except ImportError as e2:
+                print(f"LangChain not fully available: {e}")
+                print(f"ReAct also failed: {e2}")
+                print("Running in direct mode only")
+                mode = False
+        LANGCHAIN_AVAILABLE = mode
+    return LANGCHAIN_AVAILABLE
+
+
 def create_weather_agent():
     """Create LangChain agent with weather tool"""
     
     # Initialize Ollama LLM with extended timeout for first request
-    llm = ChatOllama(
+    mode = load_langchain()
+    llm = _LANGCHAIN["ChatOllama"](
         model=OLLAMA_MODEL,
         base_url=OLLAMA_URL,
         temperature=0.7,
@@ -217,16 +434,15 @@ def create_weather_agent():
     )
     
     # Define tools
-    tools = [get_weather]
+    tools = [_LANGCHAIN["weather_tool"]]
     
-    if LANGCHAIN_AVAILABLE == "react":
+    if mode == "react":
         # Use LangGraph ReAct agent
-        from langgraph.prebuilt import create_react_agent
-        agent = create_react_agent(llm, tools)
+        agent = _LANGCHAIN["create_react_agent"](llm, tools)
         return agent
     else:
         # Use traditional AgentExecutor
-        prompt = ChatPromptTemplate.from_messages([
+        prompt = _LANGCHAIN["ChatPromptTemplate"].from_messages([
             ("system", """You are a helpful weather assistant. When users ask about weather, 
 use the get_weather tool to fetch real weather data. The tool uses Agent Identity 
 authentication to securely access the weather API.
@@ -237,9 +453,9 @@ After getting weather data, provide a friendly, conversational response."""),
             ("placeholder", "{agent_scratchpad}"),
         ])
         
-        agent = create_tool_calling_agent(llm, tools, prompt)
+        agent = _LANGCHAIN["create_tool_calling_agent"](llm, tools, prompt)
         
-        agent_executor = AgentExecutor(
+        agent_executor = _LANGCHAIN["AgentExecutor"](
             agent=agent,
             tools=tools,
             verbose=True,
@@ -250,30 +466,58 @@ After getting weather data, provide a friendly, conversational response."""),
         return agent_executor
 
 
+# Agent is built once and reused (OLLAMA_MODEL/OLLAMA_URL don't change at runtime)
+_AGENT = None
+_AGENT_LOCK = threading.Lock()
+
+
+def get_weather_agent():
+    """Return the shared LangChain agent, creating it on first use"""
+    global _AGENT
+    if _AGENT is None:
+        with _AGENT_LOCK:
+            if _AGENT is None:
+                _AGENT = create_weather_agent()
+    return _AGENT
+
+
 def process_with_langchain(user_query: str):
     """Process query using LangChain agent with tools"""
-    clear_debug()
     log_debug("0. START", f"User query: {user_query}")
     log_debug("0. LANGCHAIN", f"Sending query to LangChain agent (mode: {LANGCHAIN_AVAILABLE})")
     
     try:
-        agent = create_weather_agent()
-        log_debug("0. AGENT READY", f"LangChain agent created with Ollama ({OLLAMA_MODEL})")
+        agent = get_weather_agent()
+        log_debug("0. AGENT READY", f"LangChain agent ready with Ollama ({OLLAMA_MODEL})")
         
+        # /api/chat/stream: forward the LLM's tokens to the browser as they are generated
+        listener = g.get('debug_listener')
         if LANGCHAIN_AVAILABLE == "react":
             # LangGraph ReAct agent uses different interface
-            result = agent.invoke({"messages": [("human", user_query)]})
+            inputs = {"messages": [("human", user_query)]}
+            if listener is None:
+                result = agent.invoke(inputs)
+            else:
+                result = {}
+                for mode, payload in agent.stream(inputs, stream_mode=["messages", "values"]):
+                    if mode == "values":
+                        result = payload
+                        continue
+                    chunk, metadata = payload
+                    if metadata.get("langgraph_node") == "agent" and isinstance(chunk.content, str) and chunk.content:
+                        listener.put(("token", {"text": chunk.content}))
             # Extract final message
             output = result.get("messages", [])[-1].content if result.get("messages") else "No response"
         else:
-            result = agent.invoke({"input": user_query})
+            config = {"callbacks": [_LANGCHAIN["TokenForwarder"](listener)]} if listener is not None else None
+            result = agent.invoke({"input": user_query}, config=config)
             output = result.get("output", "No response from agent")
         
         log_debug("5. COMPLETE", "LangChain agent finished processing")
         
         return {
             "response": output,
-            "debug": debug_logs,
+            "debug": list(g.debug_logs),
             "success": True,
             "agent_type": "langchain"
         }
@@ -281,35 +525,35 @@ def process_with_langchain(user_query: str):
         log_debug("ERROR", f"LangChain agent failed: {str(e)}")
         return {
             "response": f"Agent error: {str(e)}",
-            "debug": debug_logs,
+            "debug": list(g.debug_logs),
             "success": False,
             "agent_type": "langchain"
         }
 
 
+# City extraction patterns (compiled once)
+# "in <city>" / "for <city>" at the end, in one pass ("in" wins when both are present)
+_RE_CITY = re.compile(
+    r'(?:.*?\bin\s+([A-Za-z][A-Za-z\s]*?)|.*?\bfor\s+([A-Za-z][A-Za-z\s]*?))$',
+    re.IGNORECASE | re.DOTALL,
+)
+_COMMON_WORDS = frozenset({'weather', 'what', 'is', 'the', 'how', 'today', 'now', 'like'})
+
+
 def process_without_llm(user_query: str):
     """Fallback: Process query without LLM (direct tool call)"""
-    clear_debug()
     log_debug("0. START", f"Processing query (no LLM): {user_query}")
     
     # Extract city from query
-    import re
-    
     city = None
     
     # Clean the query
     clean_query = user_query.strip().rstrip('?').rstrip('.')
     
-    # Pattern 1: "in <city>" at the end - most common pattern
-    match = re.search(r'\bin\s+([A-Za-z][A-Za-z\s]*?)$', clean_query, re.IGNORECASE)
+    # Pattern 1/2: "in <city>" or "for <city>" at the end
+    match = _RE_CITY.match(clean_query)
     if match:
-        city = match.group(1).strip()
-    
-    # Pattern 2: "for <city>" at the end
-    if not city:
-        match = re.search(r'\bfor\s+([A-Za-z][A-Za-z\s]*?)$', clean_query, re.IGNORECASE)
-        if match:
-            city = match.group(1).strip()
+        city = (match.group(1) or match.group(2)).strip()
     
     # Pattern 3: Just the last word if it looks like a city name (capitalized)
     if not city:
@@ -317,8 +561,7 @@ def process_without_llm(user_query: str):
         if words:
             last_word = words[-1]
             # Check if it's not a common word
-            common_words = {'weather', 'what', 'is', 'the', 'how', 'today', 'now', 'like'}
-            if last_word.lower() not in common_words:
+            if last_word.lower() not in _COMMON_WORDS:
                 city = last_word
     
     # Default fallback
@@ -340,16 +583,22 @@ def process_without_llm(user_query: str):
     
     return {
         "response": response,
-        "debug": debug_logs,
+        "debug": list(g.debug_logs),
         "success": True,
         "agent_type": "direct"
     }
 
 
-def check_ollama_available():
+# Ollama is probed by a background thread every OLLAMA_POLL_SECONDS;
+# request handlers only read the last result
+OLLAMA_POLL_SECONDS = 5
+_ollama_ready = threading.Event()
+
+
+def _probe_ollama():
     """Check if Ollama is running and has the model"""
     try:
-        response = requests.get(f"{OLLAMA_URL}/api/tags", timeout=5)
+        response = _SESSION.get(f"{OLLAMA_URL}/api/tags", timeout=5)
         if response.status_code == 200:
             models = response.json().get("models", [])
             model_names = [m.get("name", "").split(":")[0] for m in models]
@@ -359,45 +608,137 @@ def check_ollama_available():
     return False
 
 
+def _poll_ollama():
+    while True:
+        if _probe_ollama():
+            _ollama_ready.set()
+        else:
+            _ollama_ready.clear()
+        time.sleep(OLLAMA_POLL_SECONDS)
+
+
+def check_ollama_available():
+    """Return the last background probe result (no network I/O on the request path)"""
+    return _ollama_ready.is_set()
+
+
+threading.Thread(target=_poll_ollama, daemon=True).start()
+
+
 # ============================================
 # Flask Routes
 # ============================================
 @app.route('/')
 def index():
-    """Serve the chat UI"""
-    return render_template_string(CHAT_UI_TEMPLATE)
+    """Serve the chat UI (pre-rendered and pre-compressed at startup)"""
+    if request.if_none_match.contains(_UI_ETAG):
+        response = Response(status=304)
+    else:
+        accepted = request.accept_encodings
+        if _UI_BR is not None and 'br' in accepted:
+            response = Response(_UI_BR, mimetype='text/html')
+            response.headers['Content-Encoding'] = 'br'
+        elif 'gzip' in accepted:
+            response = Response(_UI_GZ, mimetype='text/html')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            # Uncompressed body goes out via sendfile() from the copy written at startup
+            response = send_file(_UI_PATH, mimetype='text/html', etag=False)
+    response.set_etag(_UI_ETAG)
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
 
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
-    """Handle chat messages"""
-    data = request.json
+def handle_chat(data):
+    """Run one chat turn in the current app context and return (response_dict, http_status)"""
     user_message = data.get('message', '')
     use_langchain = data.get('use_langchain', True)
     
     if not user_message:
-        return jsonify({"error": "No message provided"}), 400
+        return {"error": "No message provided"}, 400
+    
+    g.debug_logs = deque(maxlen=DEBUG_LOG_MAX_ENTRIES)
+    # Clients that don't show the debug panel can send "debug": false to skip JWT claim decoding
+    g.debug_enabled = bool(data.get('debug', True))
+    if use_langchain and load_langchain():
+        # Fetch the agent token while we probe Ollama and wait on the LLM
+        prefetch_agent_token()
     
     # Check if LangChain/Ollama should be used
-    if use_langchain and LANGCHAIN_AVAILABLE and check_ollama_available():
+    if use_langchain and load_langchain() and check_ollama_available():
         result = process_with_langchain(user_message)
     else:
         result = process_without_llm(user_message)
     
-    return jsonify(result)
+    return result, 200
 
 
-@app.route('/api/status', methods=['GET'])
-def status():
-    """Check service status"""
-    ollama_ready = check_ollama_available()
-    return jsonify({
+@app.route('/api/chat', methods=['POST'])
+def chat():
+    """Handle chat messages"""
+    result, status_code = handle_chat(request.json)
+    return jsonify(result), status_code
+
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Handle chat messages as Server-Sent Events.
+    
+    Emits one 'debug' event per log_debug() entry and one 'token' event per LLM
+    token while the agent runs, then a final 'result' event with the same
+    payload /api/chat would return.
+    """
+    data = request.json
+    events = queue.Queue()
+    
+    def worker():
+        with app.app_context():
+            g.debug_listener = events
+            try:
+                result, _ = handle_chat(data)
+            except Exception as e:
+                result = {"error": f"Agent error: {str(e)}"}
+        events.put(("result", result))
+    
+    def generate():
+        threading.Thread(target=worker, daemon=True).start()
+        while True:
+            event, payload = events.get()
+            yield f"event: {event}\ndata: {app.json.dumps(payload)}\n\n"
+            if event == "result":
+                break
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def _status_variant(ollama_ready):
+    """Pre-serialize the /api/status body and its ETag (only ollama_available changes at runtime)"""
+    body = app.json.dumps({
         "ollama_available": ollama_ready,
         "ollama_url": OLLAMA_URL,
         "ollama_model": OLLAMA_MODEL,
         "sidecar_url": SIDECAR_URL,
         "agent_app_id": AGENT_APP_ID[:8] + "..." if AGENT_APP_ID else "not set"
-    })
+    }).encode('utf-8')
+    return body, hashlib.sha1(body).hexdigest()
+
+
+_STATUS_VARIANTS = {ready: _status_variant(ready) for ready in (True, False)}
+
+
+@app.route('/api/status', methods=['GET'])
+def status():
+    """Check service status"""
+    body, etag = _STATUS_VARIANTS[check_ollama_available()]
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=10'
+    return response
 
 
 @app.route('/health')
@@ -716,6 +1057,67 @@ CHAT_UI_TEMPLATE = '''
             debugContent.scrollTop = debugContent.scrollHeight;
         }
         
+        // POST to /api/chat/stream and read Server-Sent Events from the response body.
+        // Renders each 'debug' event as it arrives and resolves with the final 'result' payload,
+        // or with null when the stream could not be started (the caller then uses /api/chat).
+        async function streamChat(body, signal) {
+            let response;
+            try {
+                response = await fetch('/api/chat/stream', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify(body),
+                    signal: signal
+                });
+            } catch (error) {
+                if (error.name === 'AbortError') throw error;
+                return null;
+            }
+            if (!response.ok || !response.body) return null;
+            
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            const liveEntries = [];
+            let buffer = '';
+            // LLM tokens go into a provisional bubble that the final response replaces
+            let liveReply = null;
+            try {
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    let sep;
+                    while ((sep = buffer.indexOf('\\n\\n')) !== -1) {
+                        const raw = buffer.slice(0, sep);
+                        buffer = buffer.slice(sep + 2);
+                        let event = 'message', payload = '';
+                        raw.split('\\n').forEach(line => {
+                            if (line.startsWith('event: ')) event = line.slice(7);
+                            else if (line.startsWith('data: ')) payload += line.slice(6);
+                        });
+                        const parsed = JSON.parse(payload);
+                        if (event === 'result') return parsed;
+                        if (event === 'debug') {
+                            liveEntries.push(parsed);
+                            updateDebug(liveEntries);
+                        } else if (event === 'token') {
+                            if (!liveReply) {
+                                liveReply = document.createElement('div');
+                                liveReply.className = 'message assistant';
+                                liveReply.style.whiteSpace = 'pre-wrap';
+                                chatMessages.appendChild(liveReply);
+                            }
+                            liveReply.textContent += parsed.text;
+                            chatMessages.scrollTop = chatMessages.scrollHeight;
+                        }
+                    }
+                }
+            } finally {
+                if (liveReply) liveReply.remove();
+            }
+            throw new Error('Stream ended without a result');
+        }
+        
         async function sendMessage() {
             const message = userInput.value.trim();
             if (!message) return;
@@ -734,27 +1136,35 @@ CHAT_UI_TEMPLATE = '''
                 const controller = new AbortController();
                 const timeoutId = setTimeout(() => controller.abort(), isLangChain ? 120000 : 30000);
                 
-                const response = await fetch('/api/chat', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ 
-                        message: message,
-                        use_langchain: isLangChain
-                    }),
-                    signal: controller.signal
-                });
+                const body = { 
+                    message: message,
+                    use_langchain: isLangChain
+                };
+                // Stream debug steps as they happen; falls back to /api/chat only if the stream failed to start
+                let data = await streamChat(body, controller.signal);
+                if (data === null) {
+                    const response = await fetch('/api/chat', {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify(body),
+                        signal: controller.signal
+                    });
+                    data = await response.json();
+                }
                 clearTimeout(timeoutId);
                 
-                const data = await response.json();
-                
-                let agentInfo = data.agent_type === 'langchain' 
-                    ? '<br><small><em>🔗 Response from LangChain Agent</em></small>'
-                    : '<br><small><em>⚡ Direct tool call (LLM skipped)</em></small>';
-                
-                addMessage(data.response + agentInfo, false);
-                
-                if (data.debug) {
-                    updateDebug(data.debug);
+                if (data.error) {
+                    addMessage('Error: ' + data.error, false);
+                } else {
+                    let agentInfo = data.agent_type === 'langchain' 
+                        ? '<br><small><em>🔗 Response from LangChain Agent</em></small>'
+                        : '<br><small><em>⚡ Direct tool call (LLM skipped)</em></small>';
+                    
+                    addMessage(data.response + agentInfo, false);
+                    
+                    if (data.debug) {
+                        updateDebug(data.debug);
+                    }
                 }
             } catch (error) {
                 if (error.name === 'AbortError') {
@@ -775,6 +1185,28 @@ CHAT_UI_TEMPLATE = '''
 </html>
 '''
 
+_MINIFY_COMMENTS = re.compile(r'<!--.*?-->|/\*.*?\*/', re.DOTALL)
+
+
+def minify_html(html: str) -> str:
+    """Strip comments, indentation and blank lines (newlines are kept so inline JS stays valid)"""
+    html = _MINIFY_COMMENTS.sub('', html)
+    lines = (line.strip() for line in html.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+
+# Template string is constant: render, minify and compress it once
+_CHAT_UI = app.jinja_env.from_string(CHAT_UI_TEMPLATE)
+_UI_HTML = minify_html(_CHAT_UI.render()).encode('utf-8')
+_UI_GZ = gzip.compress(_UI_HTML, compresslevel=9)
+_UI_BR = brotli.compress(_UI_HTML, quality=11) if brotli else None
+_UI_ETAG = hashlib.sha256(_UI_HTML).hexdigest()[:16]
+_UI_PATH = os.path.join(tempfile.gettempdir(), f"llm-agent-ui-{_UI_ETAG}.html")
+# Each worker writes its own temp file and renames it into place, so a reader never sees a partial page
+with tempfile.NamedTemporaryFile(dir=os.path.dirname(_UI_PATH), prefix="llm-agent-ui-", suffix=".tmp", delete=False) as f:
+    f.write(_UI_HTML)
+os.replace(f.name, _UI_PATH)
+
 
 if __name__ == '__main__':
     print("=" * 60)
@@ -789,4 +1221,5 @@ if __name__ == '__main__':
     print("  Open http://localhost:3000 in your browser")
     print("=" * 60)
     
-    app.run(host='0.0.0.0', port=3000, debug=True)
+    # Production runs under gunicorn (see gunicorn.conf.py); FLASK_DEV=1 enables the reloader/debugger
+    app.run(host='0.0.0.0', port=3000, debug=os.environ.get('FLASK_DEV') == '1', threaded=True)
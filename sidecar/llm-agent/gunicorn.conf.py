@@ -0,0 +1,9 @@
+# Gunicorn settings for the LLM agent (loaded automatically from the working directory)
+# Request handling is dominated by outbound HTTP waits (Ollama, sidecar, Weather API),
+# so a thread pool per worker overlaps them cheaply.
+bind = "0.0.0.0:3000"
+workers = 2
+worker_class = "gthread"
+threads = 32
+# Above the 120s Ollama timeout so a cold model load doesn't get the worker killed
+timeout = 130
@@ -0,0 +1,8 @@
+# Gunicorn settings for the Weather API (loaded automatically from the working directory)
+# Handlers mostly wait on Open-Meteo, so gevent workers (which monkey-patch sockets on
+# start-up) let one process overlap many outbound calls.
+bind = "0.0.0.0:8080"
+workers = 2
+worker_class = "gevent"
+worker_connections = 200
+timeout = 60